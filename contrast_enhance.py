@@ -3,10 +3,11 @@
 import sys
 import argparse
 import logging
-import cv2
 
 def read_and_split_image(source_file):
     """ Read an image file and split into l, a, and b channels """
+    import cv2
+
     test_image = cv2.imread(source_file, 1)
     if test_image is None:
         logging.error('Unable to read input file: %s.', source_file)
@@ -24,6 +25,8 @@ def measure_contrast(lumin):
 
 def enhance_contrast(lumin, limit):
     """ Enhance contrast by applying Contrast Limited Adaptive Histogram Equalization (CLAHE) """
+    import cv2
+
     clahe = cv2.createCLAHE(clipLimit=float(limit), tileGridSize=(8, 8))
     cl = clahe.apply(lumin)
 
@@ -31,6 +34,8 @@ def enhance_contrast(lumin, limit):
 
 def write_image(l, a, b, new_file):
     """ Recombine the l, a, and b channels and write the resulting image """
+    import cv2
+
     limg = cv2.merge((l, a, b))
     nimg = cv2.cvtColor(limg, cv2.COLOR_LAB2BGR)
     write_status = cv2.imwrite(new_file, nimg)
@@ -3,11 +3,11 @@
 
 import os
 import time
-import subprocess
-from watchdog.observers import Observer
-from watchdog.events import PatternMatchingEventHandler
+import logging
+from functools import partial
+from process_video import PipelineConfig, process_video
 
-def on_created(event):
+def on_created(event, config):
     """ Function to handle new file creating event """
     print(f'{event.src_path} has been created.')
     file_size = -1
@@ -15,18 +15,31 @@ def on_created(event):
         file_size = os.path.getsize(event.src_path)
         time.sleep(1)
 
-    subprocess.run(['/usr/bin/python3', './process_video.py', event.src_path], stdout=subprocess.DEVNULL,
-                   stderr=subprocess.DEVNULL, check=True)
+    try:
+        result = process_video(event.src_path, config)
+        for stream in result.streams:
+            print(f'{stream.frame_count} frames written to {stream.png_dir}, '
+                  f'dropped: {stream.dropped}.')
+    except Exception:
+        logging.exception('Processing %s failed.', event.src_path)
+        print(f'Processing {event.src_path} failed.')
 
 def main():
     """ Main driver for file monitor utility """
+    from watchdog.observers import Observer
+    from watchdog.events import PatternMatchingEventHandler
+
+    config = PipelineConfig.from_ini('pipeline.ini')
+    logging.basicConfig(filename='pipeline.log', format='%(asctime)s: %(levelname)s %(message)s',
+                        level=getattr(logging, config.log_level.upper(), logging.ERROR))
+
     patterns = '*.ts'
     ignore_patterns = ''
     ignore_directories = True
     case_sensitive = True
     my_event_handler = PatternMatchingEventHandler(patterns, ignore_patterns,
                                                    ignore_directories, case_sensitive)
-    my_event_handler.on_created = on_created
+    my_event_handler.on_created = partial(on_created, config=config)
 
     path = './incoming'
     go_recursively = True
@@ -12,25 +12,134 @@ import secrets
 import string
 import datetime
 from functools import partial
+from multiprocessing.pool import ThreadPool
 import subprocess
 import configparser
 import argparse
 import logging
 import pathlib
 import json
-import pytz
-import cv2
-import numpy as np
-from PIL.PngImagePlugin import PngImageFile, PngInfo
-import simplekml
+import time
+import threading
+import collections
+from typing import NamedTuple, Optional
 from klvblock import KLVBlock
 
 VALID_KEY = [0x06, 0x0e, 0x2b, 0x34, 0x02, 0x0b, 0x01, 0x01, 0x0e, 0x01, 0x03, 0x01,
              0x01, 0x00, 0x00, 0x00]
 INCOMING = 'incoming'
 OUTGOING = 'processed'
+SELECTION_MODES = ('interval', 'sharpest')
+# approximate width in pixels of the luma plane used to judge frames
+ANALYSIS_WIDTH = 240
+# seconds to wait for ffmpeg to exit once a live stream has ended
+FFMPEG_EXIT_TIMEOUT = 10
+# bytes of a live stream read from stdin to find its video and KLV streams
+LIVE_PROBE_BYTES = 2 * 1024 * 1024
 
-def generate_id(id_len, _randint=np.random.randint):
+class PipelineConfig(NamedTuple):
+    """ Operating parameters for a processing run, normally read from pipeline.ini """
+    mission: str
+    interval: int = 1
+    log_level: str = 'ERROR'
+    output_dir: str = OUTGOING
+    buffer_size: int = 8
+    selection: str = 'interval'
+    duplicate_threshold: int = 0
+
+    @classmethod
+    def from_ini(cls, ini_file='pipeline.ini'):
+        """ Build a configuration from the GENERAL section of an ini file """
+        config = configparser.ConfigParser()
+        if not config.read(ini_file):
+            raise FileNotFoundError(f'Configuration file {ini_file} not found.')
+        general = config['GENERAL']
+        return cls(mission=general['mission'],
+                   interval=general.getint('interval', fallback=1),
+                   log_level=general.get('logLevel', fallback='ERROR'),
+                   output_dir=general.get('outputDir', fallback=OUTGOING),
+                   buffer_size=general.getint('bufferSize', fallback=8),
+                   selection=general.get('selection', fallback='interval'),
+                   duplicate_threshold=general.getint('duplicateThreshold',
+                                                      fallback=0)).validate()
+
+    def validate(self):
+        """ Check the frame selection settings, raising ValueError if they are not usable """
+        if self.interval < 1:
+            raise ValueError(f'interval must be at least 1: {self.interval}')
+        if self.buffer_size < 1:
+            raise ValueError(f'bufferSize must be at least 1: {self.buffer_size}')
+        if self.selection not in SELECTION_MODES:
+            raise ValueError(f'Unknown frame selection mode: {self.selection}')
+        if self.duplicate_threshold < 0:
+            raise ValueError(f'duplicateThreshold must not be negative: '
+                             f'{self.duplicate_threshold}')
+        return self
+
+class StreamPair(NamedTuple):
+    """ Index of a video stream in the transport stream and of the KLV stream that goes with it """
+    video: int
+    klv: Optional[int]
+
+class StreamResult(NamedTuple):
+    """ Files produced for one video stream """
+    video: int
+    tif_dir: str
+    png_dir: str
+    metadata_file: Optional[str]
+    kml_file: Optional[str]
+    frame_count: int
+    dropped: Optional[dict] = None
+
+class RunResult(NamedTuple):
+    """ Summary of the files produced by one processing run """
+    source: str
+    streams: tuple
+    dropped: Optional[dict] = None
+    latencies: tuple = ()
+    write_latencies: tuple = ()
+    sensor_ages: tuple = ()
+
+    @property
+    def frame_count(self):
+        """ Number of frames written for all streams """
+        return sum(stream.frame_count for stream in self.streams)
+
+class FrameRingBuffer:
+    """
+    Fixed size buffer between the live decoder and the frame writer. When the writer
+    falls behind the oldest frame is dropped so the decoder never has to wait.
+    """
+    def __init__(self, size):
+        self.frames = collections.deque(maxlen=size)
+        self.dropped = 0
+        self.closed = False
+        self.ready = threading.Condition()
+
+    def put(self, item):
+        """ Add a frame, discarding the oldest one if the buffer is full """
+        with self.ready:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append(item)
+            self.ready.notify()
+
+    def get(self):
+        """ Wait for the next frame. Returns None once the buffer is closed and empty. """
+        with self.ready:
+            while not self.frames and not self.closed:
+                self.ready.wait()
+            if self.frames:
+                return self.frames.popleft()
+            return None
+
+    def close(self):
+        """ Signal that no more frames will be added """
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+
+def generate_id(id_len):
     """ Generate a unique, random key to link meta_data frames to video frames """
     pickchar = partial(secrets.choice, string.ascii_lowercase + string.ascii_uppercase +
                        string.digits)
@@ -44,87 +153,254 @@ def get_target_list(incoming_dir):
 
     return target_list
 
-def strip_meta_data(in_file, output_directory):
-    """ Seperate meta_data data from video at rate of one meta_data frame for each video frame. """
-    logger = logging.getLogger()
-    out_file = os.path.join(output_directory, pathlib.Path(in_file).stem + '.klv')
-    logging.debug('Processing %s to produce %s', in_file, out_file)
-    if logger.level == logging.DEBUG:
-        subprocess.run(['ffmpeg', '-i', in_file, '-map', '0:1',
-                        '-codec', 'copy', '-f', 'data', out_file], check=True)
-    else:
-        subprocess.run(['ffmpeg', '-i', in_file, '-map', '0:1',
-                        '-codec', 'copy', '-f', 'data', out_file], stdout=subprocess.DEVNULL,
-                       stderr=subprocess.DEVNULL, check=True)
+def discover_streams(in_file):
+    """ Find and pair the video and KLV data streams in a transport stream file """
+    probe = subprocess.run(['ffprobe', '-v', 'error', '-show_programs', '-show_streams',
+                            '-of', 'json', in_file], stdout=subprocess.PIPE, check=True)
+    pairs = pair_streams(json.loads(probe.stdout))
 
-    return out_file
+    logging.debug('Streams found in %s: %s', in_file, pairs)
+    return pairs
+
+def pair_streams(info):
+    """
+    Pair each video stream in ffprobe output with the KLV stream carried in the same
+    program. When a program has one KLV stream every video stream shares it; otherwise
+    they are paired in order, which needs as many KLV streams as video streams. Streams
+    outside any program are treated as one more program. Other data streams, such as
+    SCTE-35, are ignored.
+    """
+    groups = [program.get('streams', []) for program in info.get('programs', [])]
+    grouped = {stream['index'] for group in groups for stream in group}
+    groups.append([stream for stream in info.get('streams', []) if stream['index'] not in grouped])
+
+    pairs = []
+    for group in groups:
+        videos = [stream['index'] for stream in group if stream.get('codec_type') == 'video']
+        klvs = [stream['index'] for stream in group if stream.get('codec_type') == 'data' and
+                (stream.get('codec_name') == 'klv' or stream.get('codec_tag_string') == 'KLVA')]
+        if len(klvs) == 1:
+            klvs = klvs * len(videos)
+        elif videos and len(klvs) != len(videos):
+            logging.error('Cannot pair %i video streams with %i KLV streams: %s and %s.',
+                          len(videos), len(klvs), videos, klvs)
+            klvs = [None] * len(videos)
+        pairs += [StreamPair(video, klv) for video, klv in zip(videos, klvs)]
+
+    return sorted(pairs)
+
+def stream_name(in_file, pairs, pair):
+    """ Base name for the files of one stream. A single stream keeps the video file's name. """
+    stem = pathlib.Path(in_file).stem
+    if len(pairs) == 1:
+        return stem
+    return f'{stem}_{pair.video}'
+
+def stream_files(in_file, pairs, output_directory):
+    """
+    Name the video file and KLV file to use for each pair. Every video stream gets its own
+    file when there is more than one. The KLV file is None for a video stream without metadata.
+    """
+    files = []
+    for pair in pairs:
+        name = stream_name(in_file, pairs, pair)
+        video_file = in_file
+        if len(pairs) > 1:
+            video_file = os.path.join(output_directory, name + '.ts')
+        klv_file = None
+        if pair.klv is not None:
+            klv_file = os.path.join(output_directory, name + '.klv')
+        files.append((video_file, klv_file))
+
+    return files
+
+def demux_streams(in_file, pairs, files):
+    """ Write the streams of each pair to the files named for it in a single ffmpeg pass. """
+    command = ['ffmpeg', '-i', in_file]
+    for pair, (video_file, klv_file) in zip(pairs, files):
+        if video_file != in_file:
+            command += ['-map', f'0:{pair.video}', '-codec', 'copy', '-f', 'mpegts', video_file]
+        if klv_file is not None:
+            command += ['-map', f'0:{pair.klv}', '-codec', 'copy', '-f', 'data', klv_file]
+
+    logging.debug('Processing %s to produce %s', in_file, files)
+    if command[3:]:
+        if logging.getLogger().level == logging.DEBUG:
+            subprocess.run(command, check=True)
+        else:
+            subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           check=True)
+
+def analysis_luma(frame):
+    """ Reduce a frame to a small luma plane by sampling every nth pixel, for cheap scoring """
+    import cv2
+
+    step = max(1, frame.shape[1] // ANALYSIS_WIDTH)
+    return cv2.cvtColor(frame[::step, ::step], cv2.COLOR_BGR2GRAY)
+
+def perceptual_hash(lumin):
+    """ Compute a 64 bit difference hash of a luma plane """
+    import cv2
+    import numpy as np
+
+    small = cv2.resize(lumin, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small[:, 1:] > small[:, :-1])
+
+    return int.from_bytes(bits.tobytes(), byteorder='big')
+
+def hash_distance(hash_a, hash_b):
+    """ Number of bits that differ between two perceptual hashes """
+    return bin(hash_a ^ hash_b).count('1')
+
+def read_frames(vid_cap):
+    """ Yield each frame of an open video capture with its frame number """
+    frame_count = 0
+    rval, frame = vid_cap.read()
+    while rval:
+        yield frame_count, frame
+        frame_count += 1
+        rval, frame = vid_cap.read()
+
+def select_frames(frames, window, selection, dropped):
+    """
+    Pick one frame from each window of frames. 'interval' keeps the first frame of the
+    window. 'sharpest' keeps the frame with the highest Laplacian sharpness, counting the
+    window as 'replaced' when that is not the first frame of the window.
+    """
+    from sharpen import measure_sharpness
+
+    best = None
+    for frame_count, frame in frames:
+        if selection == 'interval':
+            if frame_count % window == 0:
+                yield frame_count, frame
+            continue
+        if best is not None and frame_count // window != best[1] // window:
+            if best[1] % window != 0:
+                dropped['replaced'] += 1
+            yield best[1], best[2]
+            best = None
+        sharpness = measure_sharpness(analysis_luma(frame))
+        if best is None or sharpness > best[0]:
+            best = (sharpness, frame_count, frame)
+
+    if best is not None:
+        if best[1] % window != 0:
+            dropped['replaced'] += 1
+        yield best[1], best[2]
+
+def grab_frames(in_file, interval, png_out_dir, tif_out_dir, selection='interval',
+                duplicate_threshold=0):
+    """
+    Extract one frame image for each interval seconds of video, chosen by selection.
+    Frames whose perceptual hash differs from the last frame written in fewer than
+    duplicate_threshold bits are dropped. Returns frames written and drops by reason.
+    """
+    import cv2
+
+    if selection not in SELECTION_MODES:
+        raise ValueError(f'Unknown frame selection mode: {selection}')
 
-def grab_frames(in_file, interval, png_out_dir, tif_out_dir):
-    """ Extract one frame image for each second of video. """
     logging.debug('Extracting frames from %s', in_file)
     vid_cap = cv2.VideoCapture(in_file)
-    frame_count = 0
+    written = 0
+    dropped = {'replaced': 0, 'duplicate': 0}
+    last_hash = None
     if vid_cap.isOpened():
-        rval = True
         logging.debug('Creating output directory: %s', tif_out_dir)
         os.makedirs(tif_out_dir, 0o777)
         os.makedirs(png_out_dir, 0o777)
     else:
-        rval = False
         logging.debug('Unable to open video file: %s', in_file)
 
-    while rval:
-        rval, frame = vid_cap.read()
-        if rval:
-            if frame_count % (interval * 30) == 0:
-                tif_outfile = os.path.join(tif_out_dir, 'frame_' + \
-                    str(frame_count).zfill(5) + '.tif')
-                png_outfile = os.path.join(png_out_dir, 'frame_' + \
-                    str(frame_count).zfill(5) + '.png')
-                rc = cv2.imwrite(tif_outfile, frame)
-                rc |= cv2.imwrite(png_outfile, frame)
-                if rc is False:
-                    logging.error('Writing image file failed.')
-                    rval = False
-                    raise IOError
-            frame_count += 1
+    for frame_count, frame in select_frames(read_frames(vid_cap), interval * 30, selection,
+                                            dropped):
+        if duplicate_threshold:
+            frame_hash = perceptual_hash(analysis_luma(frame))
+            if last_hash is not None and \
+                    hash_distance(frame_hash, last_hash) < duplicate_threshold:
+                dropped['duplicate'] += 1
+                continue
+            last_hash = frame_hash
+        tif_outfile = os.path.join(tif_out_dir, 'frame_' + \
+            str(frame_count).zfill(5) + '.tif')
+        png_outfile = os.path.join(png_out_dir, 'frame_' + \
+            str(frame_count).zfill(5) + '.png')
+        rc = cv2.imwrite(tif_outfile, frame)
+        rc |= cv2.imwrite(png_outfile, frame)
+        if rc is False:
+            logging.error('Writing image file failed.')
+            vid_cap.release()
+            raise IOError
+        written += 1
 
     vid_cap.release()
 
+    return written, dropped
+
 def decode_meta_data(in_file, out_dir):
     """
     Takes a meta_data binary file as input and outputs a JSON file with the data
     records decoded.
     """
     logging.debug('Processing metadata in %s to directory %s.', in_file, out_dir)
+    file_dict = new_metadata_dict(in_file)
     with open(in_file, "rb") as f:
-        block_count = 0
-        file_dict = {}
-        file_dict['source'] = in_file
-        file_dict['processing_date'] = \
-            datetime.datetime.utcnow().replace(tzinfo=pytz.utc).strftime('%Y-%m-%dT%H:%M:%S.%f UTC')
-        key = list(f.read(16))
-        while key:
-            if key == VALID_KEY:
-                ber_flag = int.from_bytes(f.read(1), byteorder='big')
-                if ber_flag & 0b10000000:
-                    block_size = int.from_bytes(bytes(ber_flag) + f.read(1), byteorder='big')
-                else:
-                    block_size = ber_flag
-                data_block = list(f.read(block_size))
-                logging.info('Processing meta_data frame: %i size = %i', block_count, block_size)
-                meta_data_block = KLVBlock(generate_id(16))
-                frame_key = 'frame_' + str(block_count).zfill(5)
-                file_dict[frame_key] = meta_data_block.process_block(data_block, block_size)
-                block_count += 1
-                key = list(f.read(16))
+        for block_count, block in iter_klv_blocks(f):
+            file_dict['frame_' + str(block_count).zfill(5)] = block
+
+    return write_metadata(file_dict, os.path.join(out_dir, pathlib.Path(in_file).stem + '.json'))
+
+def iter_klv_blocks(f, resync=False):
+    """
+    Read KLV blocks from a binary stream, yielding the block number and decoded records.
+    An invalid block raises RuntimeError, unless resync is set. Then None is yielded in
+    place of the records and reading continues from the next valid block key.
+    """
+    block_count = 0
+    key = list(f.read(16))
+    while key:
+        if key == VALID_KEY:
+            ber_flag = int.from_bytes(f.read(1), byteorder='big')
+            if ber_flag & 0b10000000:
+                block_size = int.from_bytes(f.read(ber_flag & 0b01111111), byteorder='big')
             else:
-                key_err_msg = f'Block Key invalid: {key}'
-                logging.error(key_err_msg)
-                key = None
+                block_size = ber_flag
+            data_block = list(f.read(block_size))
+            logging.info('Processing meta_data frame: %i size = %i', block_count, block_size)
+            meta_data_block = KLVBlock(generate_id(16))
+            if not resync:
+                yield block_count, meta_data_block.process_block(data_block, block_size)
+            else:
+                try:
+                    yield block_count, meta_data_block.process_block(data_block, block_size)
+                except (IndexError, ValueError, OverflowError):
+                    logging.error('Block %i could not be decoded.', block_count)
+                    yield block_count, None
+            block_count += 1
+            key = list(f.read(16))
+        else:
+            key_err_msg = f'Block Key invalid: {key}'
+            logging.error(key_err_msg)
+            if not resync:
                 raise RuntimeError
+            yield block_count, None
+            while key and key != VALID_KEY:
+                key = key[1:] + list(f.read(1))
+
+def new_metadata_dict(source):
+    """ Start the dictionary written to a metadata JSON file """
+    import pytz
 
-    out_file = os.path.join(out_dir, pathlib.Path(in_file).stem + '.json')
+    file_dict = {}
+    file_dict['source'] = source
+    file_dict['processing_date'] = \
+        datetime.datetime.utcnow().replace(tzinfo=pytz.utc).strftime('%Y-%m-%dT%H:%M:%S.%f UTC')
+
+    return file_dict
+
+def write_metadata(file_dict, out_file):
+    """ Write decoded metadata records to a JSON file """
     try:
         with open(out_file, 'w') as j:
             json.dump(file_dict, j, indent=4)
@@ -136,6 +412,8 @@ def decode_meta_data(in_file, out_dir):
 
 def tag_png_frames(img_dir, klv_file):
     """ Copy KLV data from the meta_data file into tEXt fields in the images """
+    import simplekml
+
     logging.debug('Tagging image files in %s using data in %s', img_dir, klv_file)
     img_list = os.listdir(img_dir)
     kml = simplekml.Kml()
@@ -143,31 +421,337 @@ def tag_png_frames(img_dir, klv_file):
         d = json.load(f)
 
     for img in img_list:
-        img_path = os.path.join(img_dir, img)
-        target_image = PngImageFile(img_path)
-        metadata = PngInfo()
-        meta = d.get(pathlib.Path(img).stem)
-        for k, v in meta.items():
-            metadata.add_text(k, v)
+        tag_png_frame(os.path.join(img_dir, img), d.get(pathlib.Path(img).stem), kml)
+
+    kml_file = os.path.join(img_dir, 'image_list.kml')
+    kml.save(kml_file)
 
-        lon = meta.get('frame_center_longitude')
-        lat = meta.get('frame_center_latitude')
-        alt = meta.get('frame_center_elevation')
-        kml.newpoint(name=img, coords=[(lon, lat, alt)])
+    return kml_file
 
-        target_image.save(img_path, pnginfo=metadata)
-        kml.save(os.path.join(img_dir, 'image_list.kml'))
+def tag_png_frame(img_path, meta, kml):
+    """ Copy one frame's KLV data into tEXt fields in the image and add it to the kml """
+    from PIL.PngImagePlugin import PngImageFile, PngInfo
+
+    target_image = PngImageFile(img_path)
+    metadata = PngInfo()
+    for k, v in meta.items():
+        metadata.add_text(k, v)
+
+    lon = meta.get('frame_center_longitude')
+    lat = meta.get('frame_center_latitude')
+    alt = meta.get('frame_center_elevation')
+    kml.newpoint(name=os.path.basename(img_path), coords=[(lon, lat, alt)])
+
+    target_image.save(img_path, pnginfo=metadata)
+
+def process_stream(pair, name, video_file, klv_file, config):
+    """ Extract, decode and tag the frames of one video stream """
+    tif_directory = os.path.join(config.output_dir, config.mission, name + '_TIF')
+    png_directory = os.path.join(config.output_dir, config.mission, name + '_PNG')
+
+    logging.info('Extracting frames from %s into %s and %s.', video_file, tif_directory,
+                 png_directory)
+    frame_count, dropped = grab_frames(video_file, config.interval, png_directory, tif_directory,
+                                       config.selection, config.duplicate_threshold)
+    logging.info('%i frames written to %s. Frames dropped: %s', frame_count, png_directory,
+                 dropped)
+
+    metadata_file = None
+    kml_file = None
+    if klv_file is not None:
+        logging.info('Decoding meta_data records from %s.', klv_file)
+        metadata_file = decode_meta_data(klv_file, tif_directory)
+
+        logging.info('Tagging png frames in %s with id and metadata', png_directory)
+        kml_file = tag_png_frames(png_directory, metadata_file)
+
+    return StreamResult(pair.video, tif_directory, png_directory, metadata_file, kml_file,
+                        frame_count, dropped)
+
+def process_video(video_source, config):
+    """
+    Run the full pipeline on one video file using the settings in config. Every video
+    stream in the file is processed, each into its own _TIF and _PNG directories.
+    Errors from ffmpeg, frame extraction or metadata decoding are raised to the caller.
+    """
+    logging.info('Processing input video file: %s.', video_source)
+    config.validate()
+
+    pairs = discover_streams(video_source)
+    if not pairs:
+        logging.error('No video streams found in %s.', video_source)
+        raise IOError
+
+    logging.info('Separating %i streams from %s to %s.', len(pairs), video_source,
+                 config.output_dir)
+    files = stream_files(video_source, pairs, config.output_dir)
+    jobs = [(pair, stream_name(video_source, pairs, pair), video_file, klv_file, config)
+            for pair, (video_file, klv_file) in zip(pairs, files)]
+    try:
+        demux_streams(video_source, pairs, files)
+        with ThreadPool(processes=len(jobs)) as pool:
+            streams = pool.starmap(process_stream, jobs)
+    finally:
+        for video_file, klv_file in files:
+            if video_file != video_source and os.path.exists(video_file):
+                os.remove(video_file)
+            if klv_file is not None and os.path.exists(klv_file):
+                os.remove(klv_file)
+
+    dropped = collections.Counter()
+    for stream in streams:
+        dropped.update(stream.dropped)
+    logging.info('Processing complete. Frames dropped: %s', dict(dropped))
+
+    return RunResult(video_source, tuple(streams), dict(dropped))
+
+def probe_live_source(source):
+    """
+    Find the first video stream of a live source and the KLV stream paired with it.
+    For stdin the first LIVE_PROBE_BYTES are read to probe, and are returned so they
+    can be passed on to ffmpeg; otherwise the returned head is None.
+    """
+    head = None
+    command = ['ffprobe', '-v', 'error', '-show_programs', '-show_streams', '-of', 'json']
+    if source == '-':
+        head = sys.stdin.buffer.read(LIVE_PROBE_BYTES)
+        probe = subprocess.run(command + ['pipe:0'], input=head, stdout=subprocess.PIPE,
+                               check=True)
+    else:
+        probe = subprocess.run(command + [source], stdout=subprocess.PIPE, check=True)
+    pairs = pair_streams(json.loads(probe.stdout))
+
+    logging.debug('Streams found in %s: %s', source, pairs)
+    return (pairs[0] if pairs else None), head
+
+def feed_live_input(head, source_stream, sink):
+    """ Pass the probed head of stdin, then everything after it, on to ffmpeg """
+    try:
+        sink.write(head)
+        sink.flush()
+        chunk = source_stream.read1(65536)
+        while chunk:
+            sink.write(chunk)
+            sink.flush()
+            chunk = source_stream.read1(65536)
+    except OSError:
+        logging.debug('ffmpeg stopped reading its input.')
+    finally:
+        try:
+            sink.close()
+        except OSError:
+            pass
+
+def live_ffmpeg_command(source, klv_fd, window, pair):
+    """
+    Build the ffmpeg command that decodes a live transport stream. One frame in each
+    window of the pair's video stream is written to stdout as a BMP image, and its raw
+    KLV stream, if it has one, is written to the file descriptor klv_fd.
+    """
+    command = ['ffmpeg', '-fflags', 'nobuffer', '-flags', 'low_delay']
+    if source == '-':
+        command += ['-i', 'pipe:0']
+    else:
+        command += ['-nostdin', '-i', source]
+    command += ['-map', f'0:{pair.video}', '-vf', f'select=not(mod(n\\,{window}))',
+                '-vsync', '0', '-f', 'image2pipe', '-c:v', 'bmp', '-pix_fmt', 'bgr24', 'pipe:1']
+    if pair.klv is not None:
+        command += ['-map', f'0:{pair.klv}', '-codec', 'copy', '-f', 'data', f'pipe:{klv_fd}']
+
+    return command
+
+def read_live_frames(stream, window, ring):
+    """
+    Read the BMP frames selected by the decoder, one per window of source frames, and
+    queue each with its source frame number and the time it left the decoder.
+    """
+    frame_count = 0
+    try:
+        header = stream.read(6)
+        while len(header) == 6 and header[:2] == b'BM':
+            size = int.from_bytes(header[2:], byteorder='little')
+            data = header + stream.read(size - 6)
+            if len(data) < size:
+                break
+            ring.put((frame_count * window, time.monotonic(), data))
+            frame_count += 1
+            header = stream.read(6)
+    finally:
+        ring.close()
+
+def read_live_klv(stream, telemetry):
+    """
+    Decode KLV blocks as they arrive, keeping the most recent one in telemetry. The
+    metadata is marked stale from a damaged block until the next good one. The arrival
+    time and Precision Time Stamp of the first time-stamped block are kept as the
+    reference for latency.
+    """
+    try:
+        for block_count, block in iter_klv_blocks(stream, resync=True):
+            if block is None:
+                telemetry['stale'] = True
+            else:
+                if telemetry['first'] is None and klv_time(block) is not None:
+                    telemetry['first'] = (time.monotonic(), klv_time(block))
+                telemetry['latest'] = (block_count, block)
+                telemetry['stale'] = False
+    finally:
+        # Keep the pipe drained so ffmpeg is never blocked writing metadata
+        while stream.read(65536):
+            pass
+
+def klv_time(meta):
+    """ Precision Time Stamp of a KLV block as a datetime, or None if it has none """
+    stamp = meta.get('time_stamp')
+    if stamp is None:
+        return None
+
+    return datetime.datetime.strptime(stamp, '%Y-%m-%dT%H:%M:%S.%f UTC')
+
+def process_live(source, config, name=None):
+    """
+    Process a live MPEG-TS stream as it arrives. source is any input ffmpeg can read,
+    such as udp://127.0.0.1:5000, or '-' to read from stdin. Frames are tagged with the
+    most recent KLV block. Runs until the stream ends or the process is interrupted.
+    Each frame's end-to-end latency is the time since the first KLV block arrived, less
+    the sensor time between that block and the frame's block. It works with a replayed
+    recording and does not need the sensor and ground clocks to agree. The time from the
+    decoder to written files and the absolute age of the Precision Time Stamp are also
+    recorded.
+    """
+    config.validate()
+
+    import cv2
+    import numpy as np
+    import simplekml
+
+    if name is None:
+        name = 'live_' + datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+    tif_directory = os.path.join(config.output_dir, config.mission, name + '_TIF')
+    png_directory = os.path.join(config.output_dir, config.mission, name + '_PNG')
+    logging.info('Processing live stream %s into %s and %s.', source, tif_directory,
+                 png_directory)
+    os.makedirs(tif_directory, 0o777)
+    os.makedirs(png_directory, 0o777)
+
+    pair, head = probe_live_source(source)
+    if pair is None:
+        logging.error('No video stream found in %s.', source)
+        raise IOError
+    if pair.klv is None:
+        logging.error('No KLV stream found in %s. Frames will not be tagged.', source)
+
+    klv_read, klv_write = os.pipe()
+    window = config.interval * 30
+    command = live_ffmpeg_command(source, klv_write, window, pair)
+    stdin = None if head is None else subprocess.PIPE
+    if logging.getLogger().level == logging.DEBUG:
+        ffmpeg = subprocess.Popen(command, stdin=stdin, stdout=subprocess.PIPE,
+                                  pass_fds=(klv_write,))
+    else:
+        ffmpeg = subprocess.Popen(command, stdin=stdin, stdout=subprocess.PIPE,
+                                  stderr=subprocess.DEVNULL, pass_fds=(klv_write,))
+    os.close(klv_write)
+    if head is not None:
+        threading.Thread(target=feed_live_input, args=(head, sys.stdin.buffer, ffmpeg.stdin),
+                         daemon=True).start()
+
+    ring = FrameRingBuffer(config.buffer_size)
+    telemetry = {'latest': None, 'stale': False, 'first': None}
+    threading.Thread(target=read_live_frames, args=(ffmpeg.stdout, window, ring),
+                     daemon=True).start()
+    threading.Thread(target=read_live_klv, args=(os.fdopen(klv_read, 'rb'), telemetry),
+                     daemon=True).start()
+
+    file_dict = new_metadata_dict(source)
+    kml = simplekml.Kml()
+    latencies = []
+    write_latencies = []
+    sensor_ages = []
+    interrupted = False
+    returncode = None
+    metadata_file = os.path.join(tif_directory, name + '.json')
+    kml_file = os.path.join(png_directory, 'image_list.kml')
+    try:
+        item = ring.get()
+        while item is not None:
+            frame_count, decoded, data = item
+            frame_key = 'frame_' + str(frame_count).zfill(5)
+            frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            tif_outfile = os.path.join(tif_directory, frame_key + '.tif')
+            png_outfile = os.path.join(png_directory, frame_key + '.png')
+            rc = cv2.imwrite(tif_outfile, frame)
+            rc |= cv2.imwrite(png_outfile, frame)
+            if rc is False:
+                logging.error('Writing image file failed.')
+                raise IOError
+            latency = None
+            if telemetry['latest'] is not None:
+                block_count, meta = telemetry['latest']
+                file_dict[frame_key] = dict(meta, klv_block=str(block_count),
+                                            klv_stale=str(telemetry['stale']))
+                tag_png_frame(png_outfile, file_dict[frame_key], kml)
+                taken = klv_time(meta)
+                if not telemetry['stale'] and taken is not None:
+                    arrived, first_taken = telemetry['first']
+                    latency = (time.monotonic() - arrived) - \
+                        (taken - first_taken).total_seconds()
+                    latencies.append(latency)
+                    sensor_ages.append((datetime.datetime.utcnow() - taken).total_seconds())
+            write_latency = time.monotonic() - decoded
+            write_latencies.append(write_latency)
+            logging.info('Wrote %s, end-to-end latency %s s, decoder to disk %.3f s, '
+                         '%i frames dropped.', frame_key,
+                         'unknown' if latency is None else f'{latency:.3f}', write_latency,
+                         ring.dropped)
+            item = ring.get()
+        try:
+            returncode = ffmpeg.wait(timeout=FFMPEG_EXIT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            logging.error('ffmpeg did not exit after the end of the stream.')
+    except KeyboardInterrupt:
+        logging.info('Live processing of %s interrupted.', source)
+        interrupted = True
+    finally:
+        if ffmpeg.poll() is None:
+            ffmpeg.terminate()
+        stopped = ffmpeg.wait()
+        if returncode is None and not interrupted:
+            returncode = stopped
+        # Keep the tags of the frames already written, even if the run failed
+        write_metadata(file_dict, metadata_file)
+        kml.save(kml_file)
+
+    if returncode and not interrupted:
+        logging.error('ffmpeg failed with return code %d.', returncode)
+        raise subprocess.CalledProcessError(returncode, command)
+
+    logging.info('Live processing complete. %i frames written, %i dropped.',
+                 len(write_latencies), ring.dropped)
+
+    stream = StreamResult(0, tif_directory, png_directory, metadata_file, kml_file,
+                          len(write_latencies))
+    return RunResult(source, (stream,), {'buffer_full': ring.dropped}, tuple(latencies),
+                     tuple(write_latencies), tuple(sensor_ages))
 
 def main():
     """ Controller for all the video and image processing """
     parser = argparse.ArgumentParser(description='Process AC14 video files.')
-    parser.add_argument('source', action='store', help='Video file to be processed.')
+    parser.add_argument('source', action='store',
+                        help='Video file to be processed, or stream to read with --live.')
+    parser.add_argument('--live', action='store_true',
+                        help='Process source as a live stream, e.g. udp://127.0.0.1:5000 or - '
+                        'for stdin.')
+    parser.add_argument('--name', action='store',
+                        help='Base name for live output directories.')
+    parser.add_argument('--config', action='store', default='pipeline.ini',
+                        help='Pipeline configuration file.')
     args = parser.parse_args()
-    config = configparser.ConfigParser()
-    config.read('pipeline.ini')
-    mission = config['GENERAL']['mission']
-    interval = int(config['GENERAL']['interval'])
-    loglevel = config['GENERAL']['logLevel']
+    try:
+        config = PipelineConfig.from_ini(args.config)
+    except (FileNotFoundError, KeyError, ValueError) as err:
+        parser.error(f'Invalid configuration in {args.config}: {err}')
+    loglevel = config.log_level
     if loglevel is not None:
         numeric_level = getattr(logging, loglevel.upper(), None)
     else:
@@ -178,43 +762,31 @@ def main():
 
     logging.info('\n* * * Start of processing run for %s * * *', INCOMING)
 
-    video_source = args.source
-    logging.info('Processing input video file: %s.', video_source)
-
-    in_file_base = pathlib.Path(video_source).stem
-    tif_directory = os.path.join(OUTGOING, mission, in_file_base + '_TIF')
-    png_directory = os.path.join(OUTGOING, mission, in_file_base + '_PNG')
-
-    logging.info('Extracting binary meta_data file from %s to %s.', video_source,
-                    tif_directory)
-
     try:
-        klv_file = strip_meta_data(video_source, OUTGOING)
+        if args.live:
+            result = process_live(args.source, config, args.name)
+            print(f'{result.frame_count} frames written, '
+                  f'{result.dropped["buffer_full"]} dropped.')
+            for label, values in (('End-to-end', result.latencies),
+                                  ('Decoder to disk', result.write_latencies),
+                                  ('Time stamp age', result.sensor_ages)):
+                if values:
+                    print(f'{label} latency mean {sum(values) / len(values):.3f} s, '
+                          f'max {max(values):.3f} s.')
+        else:
+            result = process_video(args.source, config)
+            for stream in result.streams:
+                print(f'{stream.frame_count} frames written to {stream.png_dir}.')
+            duplicates = result.dropped.get('duplicate', 0)
+            replaced = result.dropped.get('replaced', 0)
+            print(f'{result.frame_count} frames written, {duplicates} dropped as '
+                  f'near-duplicates, {replaced} intervals replaced by a sharper frame.')
     except subprocess.CalledProcessError as err:
         logging.error('ffmpeg failed with return code %d.', err.returncode)
         sys.exit(1)
-
-    logging.info('Extracting frames from %s into %s and %s.', video_source, tif_directory,
-                 png_directory)
-    try:
-        grab_frames(video_source, interval, png_directory, tif_directory)
     except IOError:
-        logging.error('Error reading or writing image frames. Exiting.')
+        logging.error('Error reading or writing image frames or metadata. Exiting.')
         sys.exit(1)
 
-    logging.info('Decoding meta_data records.')
-    try:
-        metadata_file = decode_meta_data(klv_file, tif_directory)
-    except IOError:
-        logging.error('Decoding metadata failed. Exiting.')
-        sys.exit(1)
-
-    logging.info('Tagging png frames with id and metadata')
-    tag_png_frames(png_directory, metadata_file)
-
-    os.remove(klv_file)
-
-    logging.info('Processing complete.')
-
 if __name__ == '__main__':
     main()
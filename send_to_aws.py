@@ -5,16 +5,33 @@
 import os
 import configparser
 import argparse
-import boto3
-from botocore.exceptions import NoCredentialsError
+from typing import NamedTuple
 
-OUTBOUND = 'Processed'
+OUTBOUND = 'processed'
+
+class AwsTarget(NamedTuple):
+    """ Connection details for one AWS account, normally read from aws.ini """
+    bucket: str
+    access_key: str
+    secret_key: str
+
+    @classmethod
+    def from_ini(cls, target, ini_file='aws.ini'):
+        """ Build a target from the group heading named target in an ini file """
+        config = configparser.ConfigParser()
+        if not config.read(ini_file):
+            raise FileNotFoundError(f'Configuration file {ini_file} not found.')
+        section = config[target.upper()]
+        return cls(section['bucket'], section['access_key'], section['secret_key'])
 
 def upload_to_aws(local_file, bucket, s3_file, access_key, secret_key):
     """ Upload a file to AWS S3 bucket """
+    import boto3
+    from botocore.exceptions import NoCredentialsError
+
     s3 = boto3.client('s3', aws_access_key_id=access_key,
                       aws_secret_access_key=secret_key)
-    
+
     try:
         s3.upload_file(local_file, bucket, s3_file)
         print(f'Upload of {local_file} to {bucket} as {s3_file} successful.')
@@ -32,30 +49,27 @@ def get_target_list(data_dir):
 
     return target_list
 
+def upload_mission(mission, target, outbound=OUTBOUND):
+    """ Send the TIF directories of a processed mission to the target AWS account """
+    source_dir = os.path.join(outbound, mission)
+    dir_list = get_target_list(source_dir)
+    for directory in dir_list:
+        if directory.endswith('_TIF'):
+            file_dir = os.path.join(source_dir, directory)
+            files = get_target_list(file_dir)
+            for file in files:
+                upload_to_aws(os.path.join(file_dir, file), target.bucket,
+                              mission + f'/{directory}/{file}',
+                              target.access_key, target.secret_key)
+
 def main():
     """ Driver for transfer process """
     arg_parser = argparse.ArgumentParser(description='Transfer data files to AWS S3 bucket.')
     arg_parser.add_argument('mission', action='store', help='Mission data to be transferred.')
     arg_parser.add_argument('target', action='store', help='Which AWS account to receive data.')
     args = arg_parser.parse_args()
-    mission = args.mission
-    target = args.target.upper()
-
-    config = configparser.ConfigParser()
-    config.read('aws.ini')
-    bucket = config[target]['bucket']
-    access_key_id = config[target]['access_key']
-    secret_key_id = config[target]['secret_key']
 
-    source_dir = os.path.join(OUTBOUND, mission)
-    dir_list = get_target_list(source_dir)
-    for directory in dir_list:
-        if directory.endswith('_TIF'):
-            file_dir = os.path.join(source_dir, directory)
-            files = get_target_list(file_dir)
-            for file in files:
-                upload_to_aws(file_dir + file, bucket, mission + f'/{directory}/{file}',
-                              access_key_id, secret_key_id)
+    upload_mission(args.mission, AwsTarget.from_ini(args.target))
 
 if __name__ == '__main__':
     main()
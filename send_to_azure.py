@@ -8,10 +8,9 @@ import os
 import configparser
 import logging
 from multiprocessing.pool import ThreadPool
-from azure.storage.blob import BlobServiceClient
-from azure.storage.blob import ContentSettings
 
 INCOMING = 'incoming'
+PROCESSED = 'processed'
 OUTGOING = 'pipeline'
 CONNECT_STR = r'DefaultEndpointsProtocol=https;AccountName=proto;'\
               r'AccountKey=dZCJF1UFuiyNlD5Rc/hmz0jJWUd7XWfV75MGTqUwJ0kWK/jj6H6/KM8XZlSB9ZhcK'\
@@ -19,8 +18,11 @@ CONNECT_STR = r'DefaultEndpointsProtocol=https;AccountName=proto;'\
 
 class AzureBlobFileUploader:
     """ Class to handle parallel upload of image files to Azure BLOB storage """
-    def __init__(self):
-        self.blob_service_client = BlobServiceClient.from_connection_string(CONNECT_STR)
+    def __init__(self, connect_str=CONNECT_STR, container=OUTGOING):
+        from azure.storage.blob import BlobServiceClient
+
+        self.blob_service_client = BlobServiceClient.from_connection_string(connect_str)
+        self.container = container
         self.mime_types = {'.ts': 'video/mp2t', '.tif': 'image/tiff',
                            '.png': 'image/png', '.json': 'application/json',
                            '.kml': 'application/vnd'}
@@ -39,7 +41,10 @@ class AzureBlobFileUploader:
 
     def upload_image(self, file_name):
         """ Upload one file to Azure, maintaining source file name """
-        blob_client = self.blob_service_client.get_blob_client(container=OUTGOING, blob=file_name)
+        from azure.storage.blob import ContentSettings
+
+        blob_client = self.blob_service_client.get_blob_client(container=self.container,
+                                                               blob=file_name)
         _, ext = os.path.splitext(file_name)
         mime_type = self.mime_types[ext]
         image_content_setting = ContentSettings(content_type=mime_type)
@@ -54,6 +59,26 @@ def get_target_list(incoming_dir, select):
 
     return target_list
 
+def upload_mission(mission, file_uploader, incoming=INCOMING, processed=PROCESSED):
+    """ Upload the source video and all processed images for a mission """
+    out_dir = os.path.join(processed, mission)
+    tif_dirs = get_target_list(out_dir, '_TIF')
+    png_dirs = get_target_list(out_dir, '_PNG')
+
+    # Upload source video
+    logging.info('Uploading source video.')
+    file_uploader.upload_all_images_in_folder(os.path.join(incoming, mission))
+
+    # Upload tif files
+    logging.info('Uploading tif files.')
+    for tif_dir in tif_dirs:
+        file_uploader.upload_all_images_in_folder(os.path.join(out_dir, tif_dir))
+
+    # Upload png files
+    logging.info('Uploading png files.')
+    for png_dir in png_dirs:
+        file_uploader.upload_all_images_in_folder(os.path.join(out_dir, png_dir))
+
 def main():
     """ Driver for processes that copy files to Azure Blob storage """
     config = configparser.ConfigParser()
@@ -68,26 +93,10 @@ def main():
     logging.basicConfig(filename='azure_blob.log', format='%(asctime)s: %(levelname)s %(message)s',
                         level=numeric_level)
 
-    out_dir = os.path.join('processed', mission)
-    tif_dirs = get_target_list(out_dir, '_TIF')
-    png_dirs = get_target_list(out_dir, '_PNG')
-
     # Create uploader
     file_uploader = AzureBlobFileUploader()
 
-    # Upload source video
-    logging.info('Uploading source video.')
-    file_uploader.upload_all_images_in_folder(os.path.join(INCOMING, mission))
-
-    # Upload tif files
-    logging.info('Uploading tif files.')
-    for tif_dir in tif_dirs:
-        file_uploader.upload_all_images_in_folder(os.path.join('processed', mission, tif_dir))
-
-    # Upload png files
-    logging.info('Uploading png files.')
-    for png_dir in png_dirs:
-        file_uploader.upload_all_images_in_folder(os.path.join('processed', mission, png_dir))
+    upload_mission(mission, file_uploader)
 
 if __name__ == '__main__':
     main()
@@ -3,17 +3,20 @@
 import sys
 import argparse
 import logging
-import cv2
-import numpy as np
 
 def measure_sharpness(lumin):
     """ Measure laplacian sharpness of image """
+    import cv2
+
     sharpness = cv2.Laplacian(lumin, cv2.CV_64F).var()
 
     return sharpness
 
 def sharpen(image):
     """ Apply a sharpening kernel to enhance object edges """
+    import cv2
+    import numpy as np
+
     sharpen_kernel = np.array([[-1, -1, -1, -1, -1],
                                [-1, 2, 2, 2, -1],
                                [-1, 2, 8, 2, -1],
@@ -45,6 +48,8 @@ def main():
 
     logging.info('\n* * * Start of processing run for %s * * *', source_file)
 
+    import cv2
+
     img = cv2.imread(source_file)
     if img is None:
         logging.error('Unble to read source file: %s.', source_file)